@@ -0,0 +1,44 @@
+# src/claim_extractor/cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+# Part of every key; bump to invalidate stored responses when the way they
+# are produced or interpreted changes in ways the prompt text doesn't show
+CACHE_VERSION = 1
+
+
+class ClaimCache:
+    """
+    Content-addressed store of raw LLM responses, backed by SQLite.
+
+    Keys are 128-bit BLAKE2b digests of everything that determines a
+    response (cache version, model, formatted prompt messages), so identical
+    requests are answered from disk instead of the LLM.
+    """
+
+    def __init__(self, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "responses.sqlite3"), check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT)")
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        hasher = hashlib.blake2b(digest_size=16)
+        for part in (str(CACHE_VERSION), *parts):
+            hasher.update(part.encode('utf-8'))
+            hasher.update(b'\0')
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, content: str):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO responses (key, content) VALUES (?, ?)", (key, content))
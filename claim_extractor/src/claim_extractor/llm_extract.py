@@ -1,14 +1,118 @@
+import asyncio
 import json
-import re
+import os
 import logging
-from typing import List, Dict, Any, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Union, Iterator, Callable
+
+import httpx
+
+try:
+    # Native parser; its JSONDecodeError subclasses json's, so handlers are shared
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
 
 from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from langchain_community.chat_models import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain.base_language import BaseLanguageModel
 
 from .schemas.loader import load_schema_info, LINKED_TRUST
+from .session import SESSION
+from .cache import ClaimCache
+
+logger = logging.getLogger(__name__)
+
+def _extract_first_json_array(text: str) -> Optional[str]:
+    """
+    Return the first bracket-balanced [...] span in text, or None.
+    
+    Used to salvage the claims array from a response with text around it.
+    Brackets inside JSON strings are ignored, so nested arrays and values
+    containing ']' are handled in one linear pass.
+    """
+    start = text.find('[')
+    if start < 0:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+OUTPUT_FORMAT = "Output format: Return ONLY a JSON array of claims with no explanatory text, no preamble, and no other content. The output must start with [ and end with ]. "
+# Braces are doubled because system templates go through ChatPromptTemplate formatting
+BATCH_OUTPUT_FORMAT = ("Output format: The text contains several documents, each introduced by a <<<DOC n>>> marker. "
+                       "Return ONLY a JSON object mapping each document number to the JSON array of claims from that document, "
+                       "for example {{\"1\": [...], \"2\": []}}, with no explanatory text, no preamble, and no other content. "
+                       "The output must start with {{ and end with }}. ")
+# Documents per call in extract_claims_batch; larger batches start to lose accuracy
+BATCH_SIZE = 8
+# Texts longer than this are split by extract_claims_chunked
+CHUNK_SIZE = 4000
+
+
+def _chunk_text(text: str, size: int = CHUNK_SIZE) -> List[str]:
+    """
+    Split text into pieces of at most size characters, breaking on paragraph
+    boundaries where possible. Paragraphs longer than size are hard-split.
+    """
+    chunks = []
+    current = ''
+    for paragraph in text.split('\n\n'):
+        while len(paragraph) > size:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(paragraph[:size])
+            paragraph = paragraph[size:]
+        if current and len(current) + 2 + len(paragraph) > size:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+@lru_cache(maxsize=32)
+def _load_schema_cached(schema_name: str) -> (str, str):
+    """load_schema_info, shared by every extractor using the same schema"""
+    return load_schema_info(schema_name)
+
+
+@lru_cache(maxsize=32)
+def _system_template(schema_name: str) -> str:
+    """Render the system template for a schema once per process"""
+    (schema, meta) = _load_schema_cached(schema_name)
+    return f"""You are a claim extraction assistant that outputs raw json claims in a json array. You analyze text and extract claims according to this schema:
+        {schema}
+        Consider this meta information when filling the fields
+
+        {meta}
+
+        If no clear claim is present, you may return an empty json array. ONLY derive claims from the provided text.        
+        {OUTPUT_FORMAT}
+
+        """
 
 def default_llm():
     return  ChatAnthropic(
@@ -21,7 +125,8 @@ class ClaimExtractor:
     def __init__(
         self, 
         llm: Optional[BaseLanguageModel] = None,
-        schema_name: str = LINKED_TRUST 
+        schema_name: str = LINKED_TRUST,
+        cache_dir: Optional[str] = None
     ):
         """
         Initialize claim extractor with specified schema and LLM.
@@ -30,22 +135,21 @@ class ClaimExtractor:
             llm: Language model to use (ChatOpenAI, ChatAnthropic, etc). If None, uses ChatOpenAI
             schema_name: Schema identifier or path/URL to use for extraction
             temperature: Temperature setting for the LLM if creating default
+            cache_dir: Directory for caching LLM responses; defaults to the
+                CLAIM_CACHE_DIR environment variable, no caching if neither is set
         """
-        (self.schema, self.meta)  = load_schema_info(schema_name)
+        (self.schema, self.meta)  = _load_schema_cached(schema_name)
         self.llm = llm or default_llm()
-        self.system_template = f"""You are a claim extraction assistant that outputs raw json claims in a json array. You analyze text and extract claims according to this schema:
-        {self.schema}
-        Consider this meta information when filling the fields
-
-        {self.meta}
-
-        If no clear claim is present, you may return an empty json array. ONLY derive claims from the provided text.        
-        Output format: Return ONLY a JSON array of claims with no explanatory text, no preamble, and no other content. The output must start with [ and end with ]. 
-
-        """
+        cache_dir = cache_dir or os.getenv('CLAIM_CACHE_DIR')
+        self._cache = ClaimCache(cache_dir) if cache_dir else None
+        self._model_id = str(getattr(self.llm, 'model', None) or getattr(self.llm, 'model_name', None) or type(self.llm).__name__)
+        self.system_template = _system_template(schema_name)
+        self.batch_system_template = self.system_template.replace(OUTPUT_FORMAT, BATCH_OUTPUT_FORMAT)
+        # Parsed prompt templates by (prompt, system template), built on first use
+        self._prompts: Dict[tuple, ChatPromptTemplate] = {}
 
         
-    def make_prompt(self, prompt = '') -> ChatPromptTemplate:
+    def make_prompt(self, prompt = '', system_template: Optional[str] = None) -> ChatPromptTemplate:
         """Prepare the prompt - for now this is static, later may vary by type of claim"""
         if prompt:
             prompt += " {text}"
@@ -54,9 +158,17 @@ class ClaimExtractor:
         {text}"""
        
         return ChatPromptTemplate.from_messages([
-            SystemMessagePromptTemplate.from_template(self.system_template),
+            SystemMessagePromptTemplate.from_template(system_template or self.system_template),
             HumanMessagePromptTemplate.from_template(prompt)
         ])
+
+    def _prompt_for(self, prompt = '', system_template: Optional[str] = None) -> ChatPromptTemplate:
+        """make_prompt, cached so each distinct prompt is only parsed once"""
+        key = (prompt, system_template)
+        template = self._prompts.get(key)
+        if template is None:
+            template = self._prompts[key] = self.make_prompt(prompt, system_template)
+        return template
     
     def extract_claims(self, text: str, prompt = '') -> List[dict[str, Any]]:
         """
@@ -68,24 +180,228 @@ class ClaimExtractor:
         Returns:
             str: JSON array of extracted claims
         """
-        prompt = self.make_prompt(prompt)
-        messages = prompt.format_messages(text=text)
+        prompt = self._prompt_for(prompt)
+        claims = self._complete(prompt.format_messages(text=text), self._claims_or_none)
+        return [] if claims is None else claims
+
+    def extract_claims_chunked(self, text: str, prompt = '', chunk_size: int = CHUNK_SIZE,
+                               max_workers: int = 4) -> List[dict[str, Any]]:
+        """
+        Extract claims from a long text by splitting it on paragraph boundaries
+        and extracting from the pieces concurrently. Short texts go straight to
+        extract_claims.
+        
+        Args:
+            text: Text to extract claims from
+            chunk_size: Maximum characters per LLM call
+            max_workers: Maximum LLM calls in flight
+            
+        Returns:
+            list: Claims from every chunk, in text order
+        """
+        if len(text) <= chunk_size:
+            return self.extract_claims(text, prompt)
+        chunks = _chunk_text(text, chunk_size)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+            results = pool.map(lambda chunk: self.extract_claims(chunk, prompt), chunks)
+            return [claim for claims in results for claim in claims]
+
+    def extract_claims_batch(self, texts: List[str], prompt = '', batch_size: int = BATCH_SIZE) -> List[List[dict[str, Any]]]:
+        """
+        Extract claims from several texts, sending up to batch_size of them
+        per LLM call so the system prompt is paid once per batch.
+        
+        Args:
+            texts: Texts to extract claims from
+            batch_size: Maximum number of texts per LLM call
+            
+        Returns:
+            list: One list of claims per input text, in input order
+        """
+        batch_prompt = self._prompt_for(prompt, self.batch_system_template)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            if len(batch) == 1:
+                results.append(self.extract_claims(batch[0], prompt))
+                continue
+            joined = "\n\n".join(f"<<<DOC {i}>>>\n{text}" for i, text in enumerate(batch, 1))
+            by_doc = self._complete(batch_prompt.format_messages(text=joined), self._parse_claims_by_doc) or {}
+            for i, text in enumerate(batch, 1):
+                claims = by_doc.get(str(i))
+                # Anything missing or malformed is retried on its own
+                results.append(claims if isinstance(claims, list) else self.extract_claims(text, prompt))
+        return results
+
+    def stream_claims(self, text: str, prompt = '') -> Iterator[dict[str, Any]]:
+        """
+        Yield claims one at a time while the LLM is still generating, so the
+        first claims are available long before the whole array is.
+        
+        Args:
+            text: Text to extract claims from
+            
+        Returns:
+            iterator: Claims in the order the LLM emits them
+        """
+        messages = self._prompt_for(prompt).format_messages(text=text)
+        key, content = self._cache_lookup(messages)
+        if content is not None:
+            # Replayed through the same decoder, so a hit yields what the live stream did
+            yield from self._decode_stream([content], [])
+            return
+
+        received = []
+        closed = yield from self._decode_stream((chunk.content for chunk in self.llm.stream(messages)), received)
+        # A stream cut off before its ']' is not a complete reply
+        if closed and self._cache:
+            self._cache.put(key, ''.join(received))
+
+    @staticmethod
+    def _decode_stream(pieces: Iterator[str], received: List[str]):
+        """
+        Yield each claim of the first JSON array in pieces as soon as it is
+        complete, appending every piece to received. Returns whether the
+        array's closing ']' arrived.
+        """
+        decoder = json.JSONDecoder()
+        buffer = ''
+        pos = None  # just past the array's '[' once it has arrived
+        done = False
+        for piece in pieces:
+            received.append(piece)
+            buffer += piece
+            if done:
+                continue
+            if pos is None:
+                start = buffer.find('[')
+                if start == -1:
+                    continue
+                pos = start + 1
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buffer) and buffer[pos] == ']':
+                    done = True
+                if done or pos >= len(buffer):
+                    break
+                try:
+                    claim, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    break  # claim still arriving
+                yield claim
+        return done
+
+    async def aextract_claims(self, text: str, prompt = '') -> List[dict[str, Any]]:
+        """Async extract_claims: awaits the LLM so many extractions can overlap"""
+        prompt = self._prompt_for(prompt)
+        claims = await self._acomplete(prompt.format_messages(text=text), self._claims_or_none)
+        return [] if claims is None else claims
+
+    async def aextract_many(self, texts: List[str], prompt = '', concurrency: int = 8) -> List[List[dict[str, Any]]]:
+        """
+        Extract claims from many texts with up to concurrency LLM calls in flight.
+        
+        Returns:
+            list: One list of claims per input text, in input order
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def extract(text):
+            async with semaphore:
+                return await self.aextract_claims(text, prompt)
+
+        return await asyncio.gather(*(extract(text) for text in texts))
+
+    async def aextract_claims_from_url(self, url: str, client: Optional[httpx.AsyncClient] = None) -> List[dict[str, Any]]:
+        """
+        Async extract_claims_from_url. Pass a shared client to reuse its
+        connections across many URLs.
+        """
+        if client is None:
+            async with httpx.AsyncClient(follow_redirects=True) as client:
+                return await self.aextract_claims_from_url(url, client)
+        response = await client.get(url)
+        response.raise_for_status()
+        return await self.aextract_claims(response.text)
+
+    def _cache_lookup(self, messages):
+        """Return (key, cached response) for messages, both None without a cache"""
+        if not self._cache:
+            return None, None
+        # The formatted messages cover schema, meta, prompt and text
+        key = ClaimCache.make_key(self._model_id, *(message.content for message in messages))
+        return key, self._cache.get(key)
+
+    async def _acomplete(self, messages, parse: Callable[[str], Any]) -> Any:
+        """Async _complete"""
+        key, content = self._cache_lookup(messages)
+        if content is not None:
+            parsed = parse(content)
+            if parsed is not None:
+                return parsed
+        content = (await self.llm.ainvoke(messages)).content
+        return self._store_parsed(key, content, parse)
+
+    def _complete(self, messages, parse: Callable[[str], Any]) -> Any:
+        """
+        Send messages to the LLM, via the response cache when enabled, and
+        return parse(reply). parse returns None for a reply that can't be
+        used (malformed, a refusal); those are not cached, so the next call
+        asks the LLM again instead of replaying the failure.
+        """
+        key, content = self._cache_lookup(messages)
+        if content is not None:
+            parsed = parse(content)
+            if parsed is not None:
+                return parsed
         try:
-            response = self.llm(messages)
+            content = self.llm(messages).content
         except TypeError as e:
-            logging.error(f"Failed to authenticate: {str(e)}.  Do you need to use dotenv in caller?")
+            logger.error("Failed to authenticate: %s.  Do you need to use dotenv in caller?", e)
+            raise
+        return self._store_parsed(key, content, parse)
+
+    def _store_parsed(self, key, content: str, parse: Callable[[str], Any]) -> Any:
+        parsed = parse(content)
+        if parsed is not None and self._cache:
+            self._cache.put(key, content)
+        return parsed
+
+    @staticmethod
+    def _claims_or_none(content: str) -> Optional[List[dict[str, Any]]]:
+        """Parse a reply's claims array, or return None if it has none"""
         try:
-            return json.loads(response.content)
+            claims = _json_loads(content)
         except json.JSONDecodeError as e:
             # sometimes the LLM insists on prepending some text
-            m = re.match(r'[^\[]+(\[[^\]]+\])[^\]]*$', response.content)
-            if m:
+            claims = None
+            fragment = _extract_first_json_array(content)
+            if fragment:
                 try:
-                    return json.loads(m.group(1))
+                    claims = _json_loads(fragment)
                 except json.JSONDecodeError as e:
                     pass 
-            logging.info(f"Failed to parse LLM response as JSON: {response.content}")
-            return []
+        if isinstance(claims, list):
+            return claims
+        # Responses can be long; only the start is kept, and only when debugging
+        logger.info("Failed to parse LLM response as a JSON array (%d chars)", len(content))
+        logger.debug("Unparsed LLM response: %.500s", content)
+        return None
+
+    @staticmethod
+    def _parse_claims_by_doc(content: str) -> Optional[Dict[str, Any]]:
+        # Tolerate text around the object, as with single responses
+        start, end = content.find('{'), content.rfind('}')
+        try:
+            parsed = _json_loads(content[start:end + 1]) if start != -1 else None
+        except json.JSONDecodeError:
+            parsed = None
+        if not isinstance(parsed, dict):
+            logger.info("Failed to parse batched LLM response as JSON object (%d chars)", len(content))
+            logger.debug("Unparsed LLM response: %.500s", content)
+            return None
+        return parsed
     
     def extract_claims_from_url(self, url: str) -> str:
         """
@@ -97,7 +413,6 @@ class ClaimExtractor:
         Returns:
             str: JSON array of extracted claims
         """
-        import requests
-        response = requests.get(url)
+        response = SESSION.get(url)
         response.raise_for_status()
         return self.extract_claims(response.text)
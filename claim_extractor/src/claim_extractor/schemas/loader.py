@@ -1,8 +1,10 @@
 # src/claim_extractor/schemas/loader.py
+from functools import lru_cache
 from pathlib import Path
-import requests
 from urllib.parse import urlparse
 
+from ..session import SESSION
+
 LINKED_CLAIM = 'LINKED_CLAIM'
 OPEN_CRED = 'OPEN_CRED'
 LINKED_TRUST = 'LINKED_TRUST'
@@ -33,9 +35,11 @@ def load_schema_info(schema_id: str) -> (str, str):
     return (schema_str, meta_info)
 
 
+@lru_cache(maxsize=32)
 def load_raw_schema(schema_id: str) -> str:
     """
     Load schema content from either URL or local file.
+    Results are cached per schema_id for the life of the process.
     
     Args:
         schema_id: Either a known schema ID from CLAIM_SCHEMAS or a path/URL
@@ -49,7 +53,7 @@ def load_raw_schema(schema_id: str) -> str:
     # Check if it's a URL
     parsed = urlparse(schema_location)
     if parsed.scheme and parsed.netloc:
-        response = requests.get(schema_location)
+        response = SESSION.get(schema_location)
         response.raise_for_status()
         return response.text
         
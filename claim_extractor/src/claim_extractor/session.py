@@ -0,0 +1,21 @@
+# src/claim_extractor/session.py
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# One pooled session per process so repeated fetches to the same host
+# reuse the TCP/TLS connection instead of reconnecting on every call
+SESSION = requests.Session()
+
+# Transient failures are retried with backoff before surfacing; by default
+# urllib3 only retries idempotent methods, which covers every fetch here.
+# Once retries run out the last response is returned rather than raising
+# RetryError, so callers' raise_for_status() still raises HTTPError
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=5, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504],
+                      raise_on_status=False),
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
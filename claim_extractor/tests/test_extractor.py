@@ -44,15 +44,20 @@ EXPECTED_CLAIMS = should[0][1]
 SAMPLE_WITH_LINK = should[1][0]
 
 
-@pytest.fixture
-def mock_llm():
+def make_mock_llm():
     mock = Mock()
     mock.return_value.content = EXPECTED_CLAIMS
     return mock
 
 @pytest.fixture
-def extractor(mock_llm):
-    return ClaimExtractor(llm=mock_llm)
+def mock_llm():
+    """Fresh mock for tests that configure it or count its calls."""
+    return make_mock_llm()
+
+@pytest.fixture(scope="module")
+def extractor():
+    """One extractor shared by the tests that only read from it."""
+    return ClaimExtractor(llm=make_mock_llm())
 
 def test_extract_claims(extractor):
     """Test basic claim extraction."""
@@ -62,6 +67,69 @@ def test_extract_claims(extractor):
     claims = result[0]  # First item in the array
     assert "effectiveDate" in claims
 
+def test_cached_response_skips_llm(mock_llm, tmp_path):
+    """Test repeated text is answered from the response cache."""
+    extractor = ClaimExtractor(llm=mock_llm, cache_dir=str(tmp_path))
+    first = extractor.extract_claims(SAMPLE_TEXT)
+    second = ClaimExtractor(llm=mock_llm, cache_dir=str(tmp_path)).extract_claims(SAMPLE_TEXT)
+    assert first == second
+    assert mock_llm.call_count == 1
+
+def test_unparseable_response_is_not_cached(mock_llm, tmp_path):
+    """Test a refusal is not replayed from the cache, so the next call asks again."""
+    mock_llm.return_value.content = "sorry, cannot"
+    extractor = ClaimExtractor(llm=mock_llm, cache_dir=str(tmp_path))
+    assert extractor.extract_claims(SAMPLE_TEXT) == []
+    mock_llm.return_value.content = EXPECTED_CLAIMS
+    assert extractor.extract_claims(SAMPLE_TEXT) == json.loads(EXPECTED_CLAIMS)
+    assert mock_llm.call_count == 2
+
+def test_salvages_nested_array_from_chatter(mock_llm):
+    """Test the claims array is recovered from text around it, nested arrays included."""
+    mock_llm.return_value.content = "Here are the claims:\n" + EXPECTED_CLAIMS + "\nHope that helps ]"
+    extractor = ClaimExtractor(llm=mock_llm)
+    assert extractor.extract_claims(SAMPLE_TEXT) == json.loads(EXPECTED_CLAIMS)
+
+def test_extract_claims_batch(mock_llm):
+    """Test batched extraction, retrying documents missing from the batch reply."""
+    batch_reply = Mock(content='Here you go: {"1": %s}' % EXPECTED_CLAIMS)
+    single_reply = Mock(content=EXPECTED_CLAIMS)
+    mock_llm.side_effect = [batch_reply, single_reply]
+    extractor = ClaimExtractor(llm=mock_llm)
+    results = extractor.extract_claims_batch([SAMPLE_TEXT, SAMPLE_WITH_LINK])
+    assert len(results) == 2
+    assert results[0] == results[1] == json.loads(EXPECTED_CLAIMS)
+    assert mock_llm.call_count == 2
+
+def test_extract_claims_chunked(mock_llm):
+    """Test long texts are split on paragraphs and the claims concatenated."""
+    extractor = ClaimExtractor(llm=mock_llm)
+    text = "\n\n".join([SAMPLE_TEXT] * 30)
+    result = extractor.extract_claims_chunked(text, chunk_size=1000)
+    assert mock_llm.call_count > 1
+    assert result == json.loads(EXPECTED_CLAIMS) * mock_llm.call_count
+
+def test_stream_claims(mock_llm):
+    """Test claims are yielded from a response arriving in small pieces."""
+    reply = "Sure: " + EXPECTED_CLAIMS.rstrip()[:-1] + ", {\"claim\": \"second\"}]"
+    mock_llm.stream.return_value = [Mock(content=reply[i:i + 7]) for i in range(0, len(reply), 7)]
+    extractor = ClaimExtractor(llm=mock_llm)
+    claims = list(extractor.stream_claims(SAMPLE_TEXT))
+    assert claims == json.loads(EXPECTED_CLAIMS) + [{"claim": "second"}]
+
+def test_stream_claims_replay_matches_live(mock_llm, tmp_path):
+    """Test a cached stream replays the same claims, and a cut-off stream isn't cached."""
+    extractor = ClaimExtractor(llm=mock_llm, cache_dir=str(tmp_path))
+    mock_llm.stream.return_value = [Mock(content='[{"a": 1}, '), Mock(content='{"b": ')]
+    assert list(extractor.stream_claims("cut off")) == [{"a": 1}]
+    assert list(extractor.stream_claims("cut off")) == [{"a": 1}]
+    assert mock_llm.stream.call_count == 2
+
+    mock_llm.stream.return_value = [Mock(content='Sure: [{"a": 1}, '), Mock(content='{"b": 2}] ok')]
+    live = list(extractor.stream_claims("complete"))
+    assert list(extractor.stream_claims("complete")) == live == [{"a": 1}, {"b": 2}]
+    assert mock_llm.stream.call_count == 3
+
 @pytest.mark.integration
 def test_default_integration_is_smart():
     """Test actual Anthropic integration. Requires API key."""
@@ -88,7 +156,7 @@ def test_default_integration_reads_links():
 def test_extract_claims_from_url(extractor):
     """Test URL extraction."""
     url = "https://example.com/article"
-    with patch('requests.get') as mock_get:
+    with patch('claim_extractor.llm_extract.SESSION.get') as mock_get:
         mock_get.return_value.text = SAMPLE_TEXT
         mock_get.return_value.raise_for_status = lambda: None
         result = extractor.extract_claims_from_url(url)
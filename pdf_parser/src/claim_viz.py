@@ -1,6 +1,9 @@
 import sys
+from html import escape
 from pathlib import Path
+from string import Template
 from claim_extractor import ClaimExtractor
+import numpy as np
 import time
 from dotenv import load_dotenv
 
@@ -8,12 +11,25 @@ load_dotenv()
 
 MAX_CHUNKS = 20
 
+# Parsed once at import rather than once per chunk
+CHUNK_TEMPLATE = Template("""
+        <div class='container'>
+            <div class='text-block $cls'>
+                <div class='metadata'>Page $page</div>
+                $text
+            </div>
+            <div class='claims-block'>$claims</div></div>""")
+
 def process_and_visualize_claims(docmgr, output_file: str = "claims_analysis.html"):
     """Process all chunks and create visualization"""
 
     # Get all chunks from ChromaDB in order
     print("Getting chunks from ChromaDB...")
-    results = docmgr.text_collection.get()
+    # Filter to text chunks in Chroma so nothing else is loaded, sorted or grouped
+    results = docmgr.text_collection.get(
+        where={"type": "text"},
+        include=["documents", "metadatas"]
+    )
     print(f"Results keys: {results.keys()}")
     print(f"Number of documents: {len(results['documents'])}")
     if len(results['documents']) > 0:
@@ -23,15 +39,15 @@ def process_and_visualize_claims(docmgr, output_file: str = "claims_analysis.htm
         print("No documents found in collection! Exiting")
         exit
     
-    # Sort by page and position
-    chunks_with_metadata = list(zip(
-        results['documents'][0:MAX_CHUNKS], 
-        results['metadatas'][0:MAX_CHUNKS]
-    ))
-    chunks_with_metadata.sort(key=lambda x: (x[1]['page']))
+    # Sort by page and position on the page
+    metadatas = results['metadatas']
+    pages = np.fromiter((m['page'] for m in metadatas), dtype=np.int32, count=len(metadatas))
+    tops = np.fromiter((m.get('bbox_top', 0) for m in metadatas), dtype=np.float32, count=len(metadatas))
+    order = np.lexsort((tops, pages))[:MAX_CHUNKS]
+    chunks_with_metadata = [(results['documents'][i], metadatas[i]) for i in order]
     
     # Start HTML document
-    html = """
+    parts = ["""
     <html>
     <head>
         <style>
@@ -45,10 +61,12 @@ def process_and_visualize_claims(docmgr, output_file: str = "claims_analysis.htm
         </style>
     </head>
     <body>
-    """
+    """]
     
     extractor = ClaimExtractor()
     current_page = -1
+    # Repeated text such as headers and footers only needs one LLM call
+    claims_by_text = {}
     
     print("Processing chunks and extracting claims...")
     total_chunks = len(chunks_with_metadata)
@@ -58,41 +76,36 @@ def process_and_visualize_claims(docmgr, output_file: str = "claims_analysis.htm
         
         # Add page marker if new page
         if metadata['page'] != current_page:
-            html += f"<div class='page-marker'>Page {metadata['page']}</div>"
+            parts.append(f"<div class='page-marker'>Page {metadata['page']}</div>")
             current_page = metadata['page']
         
         # Extract claims
-        claims = extractor.extract_claims(text)
+        if text in claims_by_text:
+            claims = claims_by_text[text]
+        else:
+            claims = claims_by_text[text] = extractor.extract_claims(text)
+            # Add a small delay to avoid rate limiting
+            time.sleep(0.1)
         has_claims = bool(claims)
         
         # Create side-by-side display
-        html += f"""
-        <div class='container'>
-            <div class='text-block {("has-claims" if has_claims else "no-claims")}'>
-                <div class='metadata'>Page {metadata['page']}</div>
-                {text}
-            </div>
-            <div class='claims-block'>
-        """
-        
         if has_claims:
-            html += "<ul>"
-            for claim in claims:
-                html += f"<li>{claim}</li>"
-            html += "</ul>"
+            claims_html = "<ul>" + "".join(f"<li>{escape(str(claim))}</li>" for claim in claims) + "</ul>"
         else:
-            html += "<em>No claims detected</em>"
-        
-        html += "</div></div>"
+            claims_html = "<em>No claims detected</em>"
         
-        # Add a small delay to avoid rate limiting
-        time.sleep(0.1)
+        parts.append(CHUNK_TEMPLATE.substitute(
+            cls="has-claims" if has_claims else "no-claims",
+            page=metadata['page'],
+            text=escape(text),
+            claims=claims_html
+        ))
     
-    html += "</body></html>"
+    parts.append("</body></html>")
+    html = "".join(parts)
     
     # Write output
-    with open(output_file, "w") as f:
-        f.write(html)
+    Path(output_file).write_bytes(html.encode("utf-8"))
     
     print(f"\nVisualization saved to {output_file}")
 
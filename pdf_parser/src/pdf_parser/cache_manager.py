@@ -1,15 +1,44 @@
 import os
-import json
+import orjson
 from datetime import datetime
 from pathlib import Path
 import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+import numpy as np
 import chromadb
 
+
 class PDFProcessingCache:
     def __init__(self, cache_dir: str = ".cache"):
         self.cache_dir = cache_dir
         os.makedirs(cache_dir, exist_ok=True)
+        self._embedding_stores: Dict[str, "EmbeddingStore"] = {}
+        self._stores_lock = threading.Lock()
+
+    def _embedding_store(self, model_name: str) -> "EmbeddingStore":
+        with self._stores_lock:
+            if model_name not in self._embedding_stores:
+                embeddings_dir = os.path.join(self.cache_dir, "embeddings")
+                os.makedirs(embeddings_dir, exist_ok=True)
+                path_prefix = os.path.join(embeddings_dir, model_name.replace('/', '_'))
+                self._embedding_stores[model_name] = EmbeddingStore(path_prefix)
+            return self._embedding_stores[model_name]
+
+    def get_embeddings(self, model_name: str, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up cached embeddings by content hash, None where not cached"""
+        return self._embedding_store(model_name).get(keys)
+
+    def put_embeddings(self, model_name: str, keys: List[str], embeddings: np.ndarray):
+        """Cache embeddings by content hash"""
+        self._embedding_store(model_name).put(keys, embeddings)
     
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        """Hash already-read file contents, matching get_file_hash"""
+        return hashlib.md5(data).hexdigest()
+
     def get_file_hash(self, filepath: str) -> str:
         """Generate hash of file contents"""
         hasher = hashlib.md5()
@@ -20,30 +49,30 @@ class PDFProcessingCache:
                 buf = f.read(65536)
         return hasher.hexdigest()
     
-    def needs_processing(self, filepath: str, pdf_name: str) -> bool:
-        """Check if PDF needs to be reprocessed"""
+    def needs_processing(self, filepath: str, pdf_name: str, file_hash: Optional[str] = None) -> bool:
+        """Check if PDF needs to be reprocessed; pass file_hash if already computed"""
         cache_path = os.path.join(self.cache_dir, f"{pdf_name}_meta.json")
         
         if not os.path.exists(cache_path):
             return True
             
         try:
-            with open(cache_path) as f:
-                metadata = json.load(f)
-            return metadata.get('file_hash') != self.get_file_hash(filepath)
+            with open(cache_path, 'rb') as f:
+                metadata = orjson.loads(f.read())
+            return metadata.get('file_hash') != (file_hash or self.get_file_hash(filepath))
         except:
             return True
     
-    def update_metadata(self, filepath: str, pdf_name: str):
-        """Save processing metadata"""
+    def update_metadata(self, filepath: str, pdf_name: str, file_hash: Optional[str] = None):
+        """Save processing metadata; pass file_hash if already computed"""
         metadata = {
-            'file_hash': self.get_file_hash(filepath),
-            'last_processed': datetime.now().isoformat(),
+            'file_hash': file_hash or self.get_file_hash(filepath),
+            'last_processed': datetime.now(),
             'filepath': filepath
         }
         
-        with open(os.path.join(self.cache_dir, f"{pdf_name}_meta.json"), 'w') as f:
-            json.dump(metadata, f)
+        with open(os.path.join(self.cache_dir, f"{pdf_name}_meta.json"), 'wb') as f:
+            f.write(orjson.dumps(metadata))
 
     def reset(self):
         """Reset the entire cache by removing all metadata files"""
@@ -77,3 +106,117 @@ class ChromaDBManager:
             self.client.delete_collection(name)
         except:
             pass
+
+
+class EmbeddingStore:
+    """Append-only table of embeddings for one model, keyed by content hash
+
+    Rows live in a flat file read through np.memmap; a sqlite index maps
+    each key to its row. Several stores (e.g. one per DocumentManager) may
+    share the same files, so row numbers are assigned inside a sqlite write
+    transaction from the data file's current size, never from a count held
+    in memory. Rows are stored as float16, which halves the file and the
+    bytes read per lookup, and are widened back to float32 on read. The
+    rounding error is relative (about 1e-3 of each component) whatever the
+    vector's norm, so it holds for the unnormalized CLIP image features as
+    well as the normalized MiniLM ones; both are far inside float16's range.
+    """
+    dtype = np.float16
+
+    def __init__(self, path_prefix: str):
+        # The dtype is part of the file names so stores written with another
+        # dtype are never misread
+        path_prefix = f"{path_prefix}.{np.dtype(self.dtype).name}"
+        self.data_path = f"{path_prefix}.bin"
+        self.lock = threading.Lock()
+        # Transactions are opened explicitly so a write can take the lock up front
+        self.db = sqlite3.connect(f"{path_prefix}.sqlite3", check_same_thread=False, isolation_level=None)
+        self.db.execute("CREATE TABLE IF NOT EXISTS rows (key TEXT PRIMARY KEY, row INTEGER)")
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS rows_row ON rows (row)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (dim INTEGER)")
+        self.dim = self._stored_dim()
+        self._data = None
+
+    def _stored_dim(self) -> Optional[int]:
+        found = self.db.execute("SELECT dim FROM meta").fetchone()
+        return found[0] if found else None
+
+    def _rows_in_file(self) -> int:
+        if not os.path.exists(self.data_path):
+            return 0
+        return os.path.getsize(self.data_path) // (self.dim * np.dtype(self.dtype).itemsize)
+
+    def _rows_for(self, keys: List[str]) -> Dict[str, int]:
+        rows = {}
+        unique_keys = list(set(keys))
+        # Stay under sqlite's bound-parameter limit
+        for start in range(0, len(unique_keys), 500):
+            part = unique_keys[start:start + 500]
+            rows.update(self.db.execute(
+                f"SELECT key, row FROM rows WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall())
+        return rows
+
+    def get(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """Return the stored embedding for each key, or None where missing"""
+        with self.lock:
+            rows = self._rows_for(keys)
+            if not rows:
+                return [None] * len(keys)
+            if self.dim is None:
+                self.dim = self._stored_dim()
+            # Other stores on the same files may have appended since the last map
+            if self._data is None or len(self._data) <= max(rows.values()):
+                self._data = np.memmap(self.data_path, dtype=self.dtype, mode='r',
+                                       shape=(self._rows_in_file(), self.dim))
+            return [np.array(self._data[rows[key]], dtype=np.float32) if key in rows else None for key in keys]
+
+    def put(self, keys: List[str], embeddings: np.ndarray):
+        """Append embeddings for keys that are not stored yet
+
+        Raises ValueError unless embeddings is one row per key, each as wide
+        as the rows already stored; a wrong-width row would shift every row
+        after it in the data file.
+        """
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or len(embeddings) != len(keys):
+            raise ValueError(f"Expected {len(keys)} embedding rows, got an array of shape {embeddings.shape}")
+        with self.lock:
+            # IMMEDIATE takes sqlite's write lock now, so no other store can
+            # append between reading the file size and recording the rows
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._rows_for(keys)
+                new_rows = {}
+                for key, embedding in zip(keys, embeddings):
+                    if key not in existing and key not in new_rows:
+                        new_rows[key] = embedding
+                if new_rows:
+                    self._append(new_rows)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                # Forget a dim recorded by the rolled-back write
+                self.dim = self._stored_dim()
+                raise
+
+    def _append(self, new_rows: Dict[str, np.ndarray]):
+        rows = np.asarray(list(new_rows.values()), dtype=self.dtype)
+        dim = self.dim or self._stored_dim()
+        if dim is None:
+            dim = rows.shape[1]
+            self.db.execute("INSERT INTO meta (dim) VALUES (?)", (dim,))
+        elif rows.shape[1] != dim:
+            raise ValueError(f"Embeddings have {rows.shape[1]} dimensions, this store holds {dim}")
+        self.dim = dim
+        # Rows start after the last whole row in the file. Rows from a write
+        # whose transaction never committed are skipped, and a partial row
+        # from an interrupted write is overwritten
+        offset = self._rows_in_file()
+        with open(self.data_path, 'r+b' if os.path.exists(self.data_path) else 'wb') as f:
+            f.seek(offset * self.dim * np.dtype(self.dtype).itemsize)
+            f.write(rows.tobytes())
+        self.db.executemany(
+            "INSERT INTO rows (key, row) VALUES (?, ?)",
+            [(key, offset + i) for i, key in enumerate(new_rows)]
+        )
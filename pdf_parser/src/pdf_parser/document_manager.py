@@ -1,20 +1,62 @@
 from pathlib import Path
-from typing import List, Dict, Any
-from .pdf_processor import PDFProcessor
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+import heapq
+import threading
+from .pdf_processor import PDFProcessor, ProcessedChunk, extract_pdf_content
 from .cache_manager import PDFProcessingCache, ChromaDBManager
-import chromadb
+import numpy as np
+
+# Chunks per collection.upsert() call
+ADD_BATCH_SIZE = 200
 
 class DocumentManager:
     def __init__(self, collection_name: str = "documents", 
              persist_dir: str = ".chromadb",
-             cache_dir: str = ".cache"):
+             cache_dir: str = ".cache",
+             shard_by: Optional[str] = None):
+        """
+        Args:
+            shard_by: Set to "pdf" to store each PDF in its own Chroma database
+                under persist_dir, so a large document does not slow down
+                queries against the others
+        """
         self.persist_dir = persist_dir
         self.collection_name = collection_name
+        self.shard_by = shard_by
         self.db_manager = ChromaDBManager(persist_dir)
         self.text_collection = self.db_manager.get_or_create_collection(f"{collection_name}_text")
         self.image_collection = self.db_manager.get_or_create_collection(f"{collection_name}_images")
         self.cache = PDFProcessingCache(cache_dir)
-        self.processor = PDFProcessor()
+        self.processor = PDFProcessor(embedding_cache=self.cache)
+        # Repeated prompts skip both model forward passes
+        self._query_embeddings = lru_cache(maxsize=256)(self._encode_query)
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        if shard_by == "pdf":
+            for shard_dir in Path(persist_dir).iterdir():
+                if (shard_dir / "chroma.sqlite3").exists():
+                    self._get_shard(shard_dir.name)
+
+    def _get_shard(self, pdf_name: str) -> Tuple[ChromaDBManager, Any, Any]:
+        """Return the (db_manager, text_collection, image_collection) shard for a PDF"""
+        with self._shards_lock:
+            if pdf_name not in self._shards:
+                db_manager = ChromaDBManager(str(Path(self.persist_dir) / pdf_name))
+                self._shards[pdf_name] = (
+                    db_manager,
+                    db_manager.get_or_create_collection(f"{self.collection_name}_text"),
+                    db_manager.get_or_create_collection(f"{self.collection_name}_images")
+                )
+            return self._shards[pdf_name]
+
+    def _collections_for(self, pdf_name: str) -> Tuple[Any, Any]:
+        """Return the text and image collections a PDF's chunks belong in"""
+        if self.shard_by == "pdf":
+            _, text_collection, image_collection = self._get_shard(pdf_name)
+            return text_collection, image_collection
+        return self.text_collection, self.image_collection
 
     def reset_collection(self):
         """Completely reset the ChromaDB collections"""
@@ -23,92 +65,196 @@ class DocumentManager:
         self.db_manager.delete_collection(f"{self.collection_name}_images")
         self.text_collection = self.db_manager.get_or_create_collection(f"{self.collection_name}_text")
         self.image_collection = self.db_manager.get_or_create_collection(f"{self.collection_name}_images")
+        with self._shards_lock:
+            shard_names = list(self._shards)
+            for pdf_name in shard_names:
+                db_manager = self._shards[pdf_name][0]
+                db_manager.delete_collection(f"{self.collection_name}_text")
+                db_manager.delete_collection(f"{self.collection_name}_images")
+            self._shards.clear()
+        for pdf_name in shard_names:
+            self._get_shard(pdf_name)
         print("ChromaDB collections reset complete")
 
-    def process_pdf(self, pdf_path: str, reset: bool = False):
-        """Process PDF and add to collections"""
+    def process_pdf(self, pdf_path: str, reset: bool = False) -> int:
+        """Process PDF and add to collections, returning the number of chunks added"""
         if reset:
             self.reset_collection()
             self.cache.reset()
             
         pdf_name = Path(pdf_path).stem
+        # Read once: the same bytes are hashed for the cache and parsed
+        data = Path(pdf_path).read_bytes()
+        file_hash = self.cache.hash_bytes(data)
 
         # Check if we need to process
-        if not self.cache.needs_processing(pdf_path, pdf_name):
+        if not self.cache.needs_processing(pdf_path, pdf_name, file_hash):
             print(f"Using existing ChromaDB data for {pdf_name}")
-            return
+            return 0
         
         print(f"\nProcessing {pdf_path}:")
         print("1. Processing PDF and generating embeddings...")
-        chunks = self.processor.process_pdf(pdf_path)
+        chunks = self.processor.process_pdf(pdf_path, data)
         print(f"   Generated {len(chunks)} chunks")
+
+        added = self._store_chunks(pdf_name, chunks)
         
+        # Update cache
+        self.cache.update_metadata(pdf_path, pdf_name, file_hash)
+        print("Processing complete!")
+        return added
+
+    def _store_chunks(self, pdf_name: str, chunks: List[ProcessedChunk]) -> int:
+        """Write a PDF's chunks to its collections, returning the number written"""
         print("2. Preparing data for ChromaDB...")
-        metadatas = []
+        batches = {
+            chunk_type: {'embeddings': [], 'ids': [], 'documents': [], 'metadatas': []}
+            for chunk_type in ('text', 'image')
+        }
+        seen_ids = set()
         for chunk in chunks:
-            metadata = chunk.metadata.copy()
-            if 'bbox' in metadata:
-                x1, y1, x2, y2 = metadata['bbox']
-                metadata['bbox_left'] = x1
-                metadata['bbox_top'] = y1
-                metadata['bbox_right'] = x2
-                metadata['bbox_bottom'] = y2
-                del metadata['bbox']
+            chunk_id = f"{pdf_name}_{chunk.chunk_id}"
+            # A duplicate id would make Chroma reject the whole batch
+            if chunk_id in seen_ids:
+                print(f"Skipping duplicate chunk: {chunk.content[:100]}...")
+                continue
+            seen_ids.add(chunk_id)
+
+            # Chroma metadata values must be scalars, so bbox is flattened
+            metadata = {k: v for k, v in chunk.metadata.items() if k != 'bbox'}
             metadata['source_document'] = pdf_name
-            metadatas.append(metadata)
+            bbox = chunk.metadata.get('bbox')
+            if bbox:
+                metadata['bbox_left'], metadata['bbox_top'], metadata['bbox_right'], metadata['bbox_bottom'] = bbox
+
+            batch = batches[chunk.type]
+            batch['embeddings'].append(chunk.embedding)
+            batch['ids'].append(chunk_id)
+            batch['documents'].append(chunk.content)
+            batch['metadatas'].append(metadata)
         
-        print(f"3. Adding chunks to ChromaDB collections...")
-        for i, chunk in enumerate(chunks):
-            try:
-                collection = self.text_collection if chunk.type == 'text' else self.image_collection
-                collection.add(
-                    embeddings=[chunk.embedding.tolist()],
-                    ids=[f"{pdf_name}_{chunk.chunk_id}"],
-                    documents=[chunk.content],
-                    metadatas=[metadatas[i]]
+        print("3. Adding chunks to ChromaDB collections...")
+        text_collection, image_collection = self._collections_for(pdf_name)
+        for collection, batch in ((text_collection, batches['text']), (image_collection, batches['image'])):
+            # Drop chunks from an earlier version of this PDF that the new
+            # version no longer has; the filter runs inside Chroma
+            collection.delete(where={"source_document": pdf_name})
+            if not batch['ids']:
+                continue
+            # Text and image embeddings have different dimensions, so each
+            # collection gets its own stacked array; Chroma takes ndarrays as-is
+            embeddings = np.stack(batch['embeddings'])
+            for start in range(0, len(batch['ids']), ADD_BATCH_SIZE):
+                end = start + ADD_BATCH_SIZE
+                collection.upsert(
+                    embeddings=embeddings[start:end],
+                    ids=batch['ids'][start:end],
+                    documents=batch['documents'][start:end],
+                    metadatas=batch['metadatas'][start:end]
                 )
-            except chromadb.errors.DuplicateIDError:
-                print(f"Skipping duplicate chunk: {chunk.content[:100]}...")
-        
-        # Update cache
-        self.cache.update_metadata(pdf_path, pdf_name)
-        print("Processing complete!")
+        return len(seen_ids)
+
+    def process_pdfs(self, pdf_paths: List[str], max_workers: Optional[int] = None,
+                     reset: bool = False) -> List[int]:
+        """Process several PDFs, returning chunk counts in input order
+
+        Text and image extraction runs in a process pool (one worker per CPU
+        by default). Embedding and collection writes stay in this process,
+        where the models are loaded, and overlap with extraction of the
+        remaining files.
+        """
+        if reset:
+            self.reset_collection()
+            self.cache.reset()
+
+        counts = [0] * len(pdf_paths)
+        pending = []
+        # Hashed once here and reused when the cache entry is written
+        file_hashes = [self.cache.get_file_hash(pdf_path) for pdf_path in pdf_paths]
+        for i, pdf_path in enumerate(pdf_paths):
+            if self.cache.needs_processing(pdf_path, Path(pdf_path).stem, file_hashes[i]):
+                pending.append(i)
+            else:
+                print(f"Using existing ChromaDB data for {Path(pdf_path).stem}")
+        if not pending:
+            return counts
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Workers get paths, not bytes: rereading a just-hashed file hits
+            # the page cache, while pickling every PDF through the pool's pipe
+            # would copy it twice more and hold them all in this process
+            extracted = executor.map(extract_pdf_content, [pdf_paths[i] for i in pending])
+            for i, (text_blocks, images) in zip(pending, extracted):
+                pdf_path = pdf_paths[i]
+                pdf_name = Path(pdf_path).stem
+                print(f"\nEmbedding {pdf_path}...")
+                chunks = self.processor.embed_content(text_blocks, images)
+                counts[i] = self._store_chunks(pdf_name, chunks)
+                self.cache.update_metadata(pdf_path, pdf_name, file_hashes[i])
+        return counts
+
+    def _encode_query(self, query_text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Embed a query for the text collection and, via CLIP's text encoder, the image collection"""
+        text_embedding = np.asarray(self.processor.text_model.encode(query_text), dtype=np.float32).reshape(1, -1)
+        image_embedding = np.asarray(self.processor.encode_clip_text(query_text), dtype=np.float32).reshape(1, -1)
+        # Cached and shared between calls, so guard against in-place edits
+        text_embedding.setflags(write=False)
+        image_embedding.setflags(write=False)
+        return text_embedding, image_embedding
 
     def query(self, query_text: str, n_results: int = 3):
-        """Query across all documents in collections"""
-        # Get text embeddings for text collection
-        text_embedding = self.processor.text_model.encode(query_text)
-        text_results = self.text_collection.query(
-            query_embeddings=[text_embedding.tolist()],
-            n_results=n_results
-        )
-        
-        # Get CLIP embeddings for image collection using the text encoder
-        inputs = self.processor.clip_processor(text=query_text, return_tensors="pt")
-        image_query_embedding = self.processor.clip_model.get_text_features(**inputs)
-        image_results = self.image_collection.query(
-            query_embeddings=[image_query_embedding.detach().numpy()[0].tolist()],
-            n_results=n_results
-        )
-        
-        formatted_results = []
-        
-        # Add text results
-        for i in range(len(text_results['documents'][0])):
-            formatted_results.append({
-                'content': text_results['documents'][0][i],
-                'metadata': text_results['metadatas'][0][i],
-                'distance': text_results['distances'][0][i]
-            })
-        
-        # Add image results
-        for i in range(len(image_results['documents'][0])):
-            formatted_results.append({
-                'content': image_results['documents'][0][i],
-                'metadata': image_results['metadatas'][0][i],
-                'distance': image_results['distances'][0][i]
-            })
-        
-        # Sort by distance and limit to n_results
-        formatted_results.sort(key=lambda x: x['distance'])
-        return formatted_results[:n_results]
+        """Query across all documents in collections
+
+        Text hits (MiniLM) and image hits (CLIP) come from different embedding
+        spaces whose distances aren't comparable, so each kind is ranked by
+        distance on its own, across all shards, and the two rankings are
+        interleaved: the best text hit, then the best image hit, then the
+        second of each, and so on. 'distance' in each result is still the raw
+        distance within its own collection.
+        """
+        if self.shard_by == "pdf":
+            with self._shards_lock:
+                collection_pairs = [(text, image) for _, text, image in self._shards.values()]
+            if not collection_pairs:
+                # No PDF has been stored yet
+                return []
+        else:
+            collection_pairs = [(self.text_collection, self.image_collection)]
+
+        text_embedding, image_embedding = self._query_embeddings(query_text)
+
+        # Every text and image sub-query is independent, so all of them overlap
+        tasks = [(text, text_embedding) for text, _ in collection_pairs]
+        tasks += [(image, image_embedding) for _, image in collection_pairs]
+
+        def run_query(task):
+            collection, embedding = task
+            return self._format_results(collection.query(
+                query_embeddings=embedding,
+                n_results=n_results
+            ))
+
+        with ThreadPoolExecutor(max_workers=min(8, len(tasks))) as executor:
+            results = list(executor.map(run_query, tasks))
+        text_hits = [r for hits in results[:len(collection_pairs)] for r in hits]
+        image_hits = [r for hits in results[len(collection_pairs):] for r in hits]
+
+        # Rank within each embedding space, then keep the n_results best ranks
+        ranked = [
+            (rank, kind, hit)
+            for kind, hits in enumerate((text_hits, image_hits))
+            for rank, hit in enumerate(heapq.nsmallest(n_results, hits, key=lambda x: x['distance']))
+        ]
+        return [hit for _, _, hit in heapq.nsmallest(n_results, ranked, key=lambda x: x[:2])]
+
+    @staticmethod
+    def _format_results(results) -> List[Dict[str, Any]]:
+        """Flatten a single-query Chroma result into content/metadata/distance dicts"""
+        return [
+            {
+                'content': results['documents'][0][i],
+                'metadata': results['metadatas'][0][i],
+                'distance': results['distances'][0][i]
+            }
+            for i in range(len(results['documents'][0]))
+        ]
@@ -1,12 +1,28 @@
 import fitz  # PyMuPDF
-from PIL import Image
-import io
+import torch
 from transformers import CLIPProcessor, CLIPModel
 from sentence_transformers import SentenceTransformer
 import numpy as np
+from functools import lru_cache
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
-import hashlib
+from typing import List, Dict, Any, Optional, Tuple
+import struct
+import xxhash
+from .cache_manager import PDFProcessingCache
+
+TEXT_MODEL_NAME = 'all-MiniLM-L6-v2'
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+# CLIP resizes the short side to this, so larger images can be shrunk first
+CLIP_IMAGE_SIZE = 224
+
+# Text blocks per SentenceTransformer forward pass
+TEXT_BATCH_SIZE = 64
+# Images per CLIP forward pass
+IMAGE_BATCH_SIZE = 32
+# Text window size in words; all-MiniLM-L6-v2 truncates input at 256 word pieces
+CHUNK_WORDS = 180
+# Words of trailing context repeated at the start of the next window
+CHUNK_OVERLAP_WORDS = 40
 
 @dataclass
 class ProcessedChunk:
@@ -16,104 +32,300 @@ class ProcessedChunk:
     chunk_id: str
     type: str = 'text'  # 'text' or 'image'
 
+def _page_sections(doc) -> List[str]:
+    """Return the outline heading path in effect at the start of each page"""
+    sections = [''] * doc.page_count
+    toc = doc.get_toc()
+    path = []
+    i = 0
+    for page_num in range(doc.page_count):
+        while i < len(toc) and toc[i][2] <= page_num + 1:
+            level, title = toc[i][0], toc[i][1].strip()
+            path = path[:level - 1] + [title]
+            i += 1
+        sections[page_num] = ' > '.join(path)
+    return sections
+
+
+def _image_array(doc: fitz.Document, xref: int) -> np.ndarray:
+    """Decode an embedded image straight to an RGB (height, width, 3) uint8 array"""
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    # Halve in place while the short side stays above CLIP's input size
+    factor = 0
+    while min(pix.width, pix.height) >> (factor + 1) >= CLIP_IMAGE_SIZE:
+        factor += 1
+    if factor:
+        pix.shrink(factor)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+
+def _word_pieces(words: List[str]) -> List[List[str]]:
+    """Cut a block longer than a window into overlapping window-sized pieces"""
+    if len(words) <= CHUNK_WORDS:
+        return [words]
+    step = CHUNK_WORDS - CHUNK_OVERLAP_WORDS
+    return [words[i:i + CHUNK_WORDS] for i in range(0, len(words) - CHUNK_OVERLAP_WORDS, step)]
+
+def _image_key(image: np.ndarray) -> str:
+    """Content hash of an image array; shape and dtype are hashed with the
+    bytes, so arrays with the same buffer but a different layout differ"""
+    hasher = xxhash.xxh3_128(image.dtype.str.encode())
+    hasher.update(struct.pack(f'<{image.ndim}q', *image.shape))
+    hasher.update(np.ascontiguousarray(image))
+    return hasher.hexdigest()
+
+def extract_pdf_content(pdf_path: str, data: Optional[bytes] = None) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[Tuple[np.ndarray, int]]]:
+    """
+    Extract (text, metadata) windows and (image, page) pairs from a PDF.
+
+    Text blocks are merged in reading order into windows of about
+    CHUNK_WORDS words that never cross an outline section, with
+    CHUNK_OVERLAP_WORDS of overlap between neighbouring windows. No window
+    is longer than CHUNK_WORDS; a longer block is split across windows.
+
+    This does no model work, so it can run in a worker process while the
+    models stay loaded in the parent. If the caller has already read the
+    file, pass its bytes as data to parse them instead of rereading it.
+    """
+    text_blocks = []
+    images = []
+    doc = fitz.open(pdf_path) if data is None else fitz.open(stream=data, filetype="pdf")
+    sections = _page_sections(doc)
+
+    # Blocks in the current window as (text, page, bbox, word_count)
+    window = []
+    window_words = 0
+    window_has_new = False
+    window_section = ''
+
+    def flush(carry: bool, incoming: int = 0):
+        nonlocal window, window_words, window_has_new
+        if window and window_has_new:
+            text = "\n".join(block[0] for block in window)
+            _, page, bbox, _ = window[0]
+            metadata = {'page': page, 'page_end': window[-1][1], 'bbox': bbox}
+            if window_section:
+                metadata['section'] = window_section
+            text_blocks.append((text, metadata))
+        carried, carried_words = [], 0
+        if carry:
+            # Carry no more than still fits beside the incoming block, and
+            # always drop the first block so every window makes progress
+            limit = min(CHUNK_OVERLAP_WORDS, CHUNK_WORDS - incoming)
+            for block in reversed(window[1:]):
+                if carried_words + block[3] > limit:
+                    break
+                carried.insert(0, block)
+                carried_words += block[3]
+        window, window_words, window_has_new = carried, carried_words, False
+
+    for page_num, page in enumerate(doc):
+        print(f"Processing page {page_num + 1}/{doc.page_count}")
+        if sections[page_num] != window_section:
+            flush(carry=False)
+            window_section = sections[page_num]
+
+        # Build the page's text layout once; any further get_text() call on
+        # this page should pass textpage=textpage rather than re-parse it
+        textpage = page.get_textpage(flags=fitz.TEXTFLAGS_BLOCKS)
+
+        # Collect text, skipping image blocks
+        for block in page.get_text("blocks", textpage=textpage):
+            if block[6] != 0:
+                continue
+            # One split both collapses PyMuPDF's hard line breaks and counts words
+            words = block[4].split()
+            if not words:
+                continue
+            for piece in _word_pieces(words):
+                piece_words = len(piece)
+                if window_words and window_words + piece_words > CHUNK_WORDS:
+                    flush(carry=True, incoming=piece_words)
+                window.append((" ".join(piece), page_num, block[:4], piece_words))
+                window_words += piece_words
+                window_has_new = True
+
+        del textpage
+
+        # Collect images
+        for img in page.get_images(full=True):
+            try:
+                xref = img[0]
+                # Decode now so a bad image is skipped rather than failing its batch
+                images.append((_image_array(doc, xref), page_num))
+            except Exception as e:
+                print(f"Error processing image on page {page_num}: {e}")
+                continue
+
+    flush(carry=False)
+    doc.close()
+    return text_blocks, images
+
+@lru_cache(maxsize=1)
+def _get_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+@lru_cache(maxsize=1)
+def _get_text_model() -> SentenceTransformer:
+    """Load MiniLM once per process; every PDFProcessor shares it"""
+    model = SentenceTransformer(TEXT_MODEL_NAME, device=_get_device())
+    model.requires_grad_(False)
+    if _get_device() == "cuda":
+        # Half precision halves memory traffic on GPU with negligible embedding loss
+        model.half()
+    return model
+
+@lru_cache(maxsize=1)
+def _get_clip_model() -> CLIPModel:
+    """Load CLIP once per process; every PDFProcessor shares it"""
+    model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).to(_get_device()).eval()
+    # Inference only, so no parameter ever needs a gradient
+    model.requires_grad_(False)
+    if _get_device() == "cuda":
+        model.half()
+    return model
+
+@lru_cache(maxsize=1)
+def _get_clip_processor() -> CLIPProcessor:
+    return CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+
 class PDFProcessor:
-    def __init__(self):
-        self.text_model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    def __init__(self, embedding_cache: Optional[PDFProcessingCache] = None):
+        """
+        Args:
+            embedding_cache: If given, embeddings are looked up by content hash
+                before encoding, so reprocessing a changed PDF only encodes
+                the text and images that changed
+        """
+        self.embedding_cache = embedding_cache
+        # Models are loaded lazily on first construction and then reused
+        self.device = _get_device()
+        self.text_model = _get_text_model()
+        self.clip_model = _get_clip_model()
+        self.clip_processor = _get_clip_processor()
+
+    def encode_clip_text(self, text: str) -> np.ndarray:
+        """Embed text into the CLIP space used by the image collection"""
+        inputs = self.clip_processor(text=text, return_tensors="pt").to(self.device)
+        with torch.inference_mode():
+            text_features = self.clip_model.get_text_features(**inputs)
+        return text_features.float().cpu().numpy()[0]
 
-    def process_pdf(self, pdf_path: str) -> List[ProcessedChunk]:
-        """Process PDF and return chunks"""
+    def process_pdf(self, pdf_path: str, data: Optional[bytes] = None) -> List[ProcessedChunk]:
+        """Process PDF and return chunks, parsing data instead of the file if given"""
         print(f"Processing PDF {pdf_path}...")
-        return self._process_pdf_internal(pdf_path)
+        return self._process_pdf_internal(pdf_path, data)
 
-    def _process_pdf_internal(self, pdf_path: str) -> List[ProcessedChunk]:
+    def _process_pdf_internal(self, pdf_path: str, data: Optional[bytes] = None) -> List[ProcessedChunk]:
         """Internal method for actual PDF processing"""
-        processed_chunks = []
-        doc = fitz.open(pdf_path)
-
-        for page_num, page in enumerate(doc):
-            print(f"Processing page {page_num + 1}/{doc.page_count}")
-            # Process text
-            text_blocks = page.get_text("blocks")
-            for block in text_blocks:
-                text = block[4]
-                if len(text.strip()) < 10:
-                    continue
-
-                chunk = self._process_text_chunk(
-                    text=text,
-                    page=page_num,
-                    bbox=block[:4]
-                )
-                processed_chunks.append(chunk)
-
-            # Process images
-            images = page.get_images(full=True)
-            for img_index, img in enumerate(images):
-                try:
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image = Image.open(io.BytesIO(image_bytes))
-
-                    chunk = self._process_image_chunk(
-                        image=image,
-                        page=page_num
-                    )
-                    processed_chunks.append(chunk)
-                except Exception as e:
-                    print(f"Error processing image on page {page_num}: {e}")
-                    continue
-
-        return processed_chunks
-
-    def _generate_chunk_id(self, content: str, page: int, bbox: Optional[List] = None) -> str:
+        return self.embed_content(*extract_pdf_content(pdf_path, data))
+
+    def embed_content(self, text_blocks: List[Tuple[str, Dict[str, Any]]],
+                      images: List[Tuple[np.ndarray, int]]) -> List[ProcessedChunk]:
+        """Embed content returned by extract_pdf_content into chunks"""
+        return self._process_text_chunks(text_blocks) + self._process_image_chunks(images)
+
+    def _generate_chunk_id(self, content: str, page: int, bbox: Optional[List] = None,
+                           index: Optional[int] = None) -> str:
         """Generate a unique ID for a chunk based on content, position and bbox"""
+        hasher = xxhash.xxh3_128(content.encode())
+        hasher.update(struct.pack('<i', page))
         if bbox:
             # Include bbox in hash if available for text chunks
-            unique_string = f"{content}_{page}_{bbox[0]}_{bbox[1]}_{bbox[2]}_{bbox[3]}"
-        else:
-            # For images, include a counter to ensure uniqueness
-            unique_string = f"{content}_{page}_{hash(content)}"
-        return hashlib.md5(unique_string.encode()).hexdigest()
-
-    def _process_text_chunk(self, text: str, page: int, bbox: Optional[List] = None) -> ProcessedChunk:
-        """Process a single text chunk"""
-        embedding = self.text_model.encode(text)
-
-        metadata = {
-            'page': page,
-            'type': 'text',
-        }
-        if bbox:
-            metadata['bbox'] = bbox
-
-        return ProcessedChunk(
-            content=text,
-            embedding=embedding,
-            metadata=metadata,
-            chunk_id=self._generate_chunk_id(text, page, bbox),  # Pass bbox to ID generation
-            type='text'
-        )
-
-    def _process_image_chunk(self, image: Image.Image, page: int) -> ProcessedChunk:
-        """Process a single image chunk"""
-        inputs = self.clip_processor(images=image, return_tensors="pt")
-        image_features = self.clip_model.get_image_features(**inputs)
-        embedding = image_features.detach().numpy()[0]
-
-        metadata = {
-            'page': page,
-            'type': 'image',
-        }
-
-        content = f"Image on page {page}"
-
-        return ProcessedChunk(
-            content=content,
-            embedding=embedding,
-            metadata=metadata,
-            chunk_id=self._generate_chunk_id(content, page),
-            type='image'
-        )
+            hasher.update(struct.pack('<4d', *bbox))
+        if index is not None:
+            # Images share their content string, so their position in the document tells them apart
+            hasher.update(struct.pack('<q', index))
+        return hasher.hexdigest()
+
+    def _cached_encode(self, model_name: str, keys: List[str], items: List, encode) -> np.ndarray:
+        """Embed items with encode(), reusing rows cached under their content hash"""
+        if self.embedding_cache is None:
+            return encode(items)
+
+        embeddings = self.embedding_cache.get_embeddings(model_name, keys)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fresh = encode([items[i] for i in missing])
+            self.embedding_cache.put_embeddings(model_name, [keys[i] for i in missing], fresh)
+            for i, embedding in zip(missing, fresh):
+                embeddings[i] = embedding
+        return np.stack(embeddings)
+
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        # encode() already sorts inputs by length before batching and restores
+        # the original order, so similar-length blocks share a padded batch
+        return self.text_model.encode(
+            texts,
+            batch_size=TEXT_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).astype(np.float32, copy=False)
+
+    def _encode_images(self, images: List[np.ndarray]) -> np.ndarray:
+        features = []
+        for start in range(0, len(images), IMAGE_BATCH_SIZE):
+            inputs = self.clip_processor(images=images[start:start + IMAGE_BATCH_SIZE], return_tensors="pt")
+            pixel_values = inputs['pixel_values'].to(self.device, dtype=self.clip_model.dtype)
+            with torch.inference_mode():
+                image_features = self.clip_model.get_image_features(pixel_values=pixel_values)
+            features.append(image_features.float().cpu().numpy())
+        return np.concatenate(features)
+
+    def _process_text_chunks(self, blocks: List[Tuple[str, Dict[str, Any]]]) -> List[ProcessedChunk]:
+        """Embed (text, metadata) windows in batches and wrap them as chunks"""
+        if not blocks:
+            return []
+
+        # The section heading is embedded with the text as context, but is
+        # only stored in metadata
+        texts = [
+            f"{metadata['section']}\n{text}" if metadata.get('section') else text
+            for text, metadata in blocks
+        ]
+        keys = [xxhash.xxh3_128_hexdigest(text.encode()) for text in texts]
+        embeddings = self._cached_encode(TEXT_MODEL_NAME, keys, texts, self._encode_texts)
+
+        chunks = []
+        for (text, block_metadata), embedding in zip(blocks, embeddings):
+            metadata = {**block_metadata, 'type': 'text'}
+            page, bbox = metadata['page'], metadata.get('bbox')
+
+            chunks.append(ProcessedChunk(
+                content=text,
+                embedding=embedding,
+                metadata=metadata,
+                chunk_id=self._generate_chunk_id(text, page, bbox),  # Pass bbox to ID generation
+                type='text'
+            ))
+        return chunks
+
+    def _process_image_chunks(self, images: List[Tuple[np.ndarray, int]]) -> List[ProcessedChunk]:
+        """Embed (image, page) pairs with CLIP in batches and wrap them as chunks"""
+        if not images:
+            return []
+
+        arrays = [image for image, _ in images]
+        keys = [_image_key(image) for image in arrays]
+        embeddings = self._cached_encode(CLIP_MODEL_NAME, keys, arrays, self._encode_images)
+
+        chunks = []
+        for index, ((_, page), embedding) in enumerate(zip(images, embeddings)):
+            metadata = {
+                'page': page,
+                'type': 'image',
+            }
+
+            content = f"Image on page {page}"
+
+            chunks.append(ProcessedChunk(
+                content=content,
+                embedding=embedding,
+                metadata=metadata,
+                chunk_id=self._generate_chunk_id(content, page, index=index),
+                type='image'
+            ))
+        return chunks
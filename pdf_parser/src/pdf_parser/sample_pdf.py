@@ -4,24 +4,25 @@ from anthropic import Anthropic
 from typing import List, Tuple
 from chromadb.utils import embedding_functions
 import chromadb
-from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
+import bm25s
 import numpy as np
 
 from .pdf_processor import PDFProcessor
 
+# Reciprocal Rank Fusion damping constant from Cormack et al.
+RRF_K = 60
+
 class LocalRAG:
-    def __init__(self, collection_name="pdf_store"):
+    def __init__(self, collection_name="pdf_store", bm25_dir="./bm25_index"):
         load_dotenv()
         self.anthropic = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
         
         # Initialize Chroma
         self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
         
-        # Use sentence-transformers embeddings
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name='all-MiniLM-L6-v2'
-        )
+        # Same all-MiniLM-L6-v2 embeddings, run through ONNX Runtime rather
+        # than PyTorch: smaller to load and faster per batch on CPU
+        self.embedding_function = embedding_functions.ONNXMiniLM_L6_V2()
         
         # Get or create collection
         self.collection = self.chroma_client.get_or_create_collection(
@@ -29,10 +30,12 @@ class LocalRAG:
             embedding_function=self.embedding_function
         )
         
-        # For BM25 hybrid search
-        self.text_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # For BM25 hybrid search; a saved index is reused so re-runs skip the rebuild
+        self.bm25_path = os.path.join(bm25_dir, collection_name)
+        # Only term weights are kept here; chunk text lives in Chroma alone
         self.bm25 = None
-        self.documents = []
+        if os.path.exists(os.path.join(self.bm25_path, "params.index.json")):
+            self.bm25 = bm25s.BM25.load(self.bm25_path, show_progress=False)
     
     def add_documents(self, processed_docs):
         """Add processed PDF data to Chroma"""
@@ -49,17 +52,20 @@ class LocalRAG:
                 'bbox': str(doc.metadata.get('bbox', ''))  # Convert bbox to string for storage
             })
         
-        # Add to Chroma
-        self.collection.add(
+        # Upsert, not add: keyword hits are fetched back by doc_{i}, so these
+        # ids must hold the texts the new BM25 index was built from, and
+        # add() would keep an earlier PDF's chunk under a reused id
+        self.collection.upsert(
             documents=texts,
             metadatas=metadatas,
             ids=ids
         )
         
-        # Update BM25 index for hybrid search
-        self.documents = texts
-        tokenized_docs = [doc.split() for doc in self.documents]
-        self.bm25 = BM25Okapi(tokenized_docs)
+        # Update BM25 index for hybrid search; bm25s lowercases and strips
+        # punctuation, and scores every (term, doc) pair once at index time
+        self.bm25 = bm25s.BM25()
+        self.bm25.index(bm25s.tokenize(texts, show_progress=False), show_progress=False)
+        self.bm25.save(self.bm25_path, show_progress=False)
     
     def hybrid_search(self, query: str, k: int = 5) -> List[dict]:
         # Vector search using Chroma
@@ -68,31 +74,47 @@ class LocalRAG:
             n_results=k
         )
         
-        # Keyword search using BM25
-        tokenized_query = query.split()
-        keyword_scores = self.bm25.get_scores(tokenized_query)
-        top_keyword_indices = np.argsort(keyword_scores)[-k:][::-1]
+        # Keyword search using BM25. The tokenizer drops stopwords and
+        # 1-character tokens, so a query like "Is it?" has no terms to score
+        # (and bm25s rejects an empty query); it uses vector results alone
+        tokenized_query = bm25s.tokenize([query], return_ids=False, show_progress=False)[0]
+        if tokenized_query:
+            keyword_scores = self.bm25.get_scores(tokenized_query)
+            # Partition out the top k in O(N), then order only those
+            k_keyword = min(k, len(keyword_scores))
+            top_keyword_indices = np.argpartition(keyword_scores, -k_keyword)[-k_keyword:]
+            top_keyword_indices = top_keyword_indices[np.argsort(keyword_scores[top_keyword_indices])[::-1]]
+        else:
+            top_keyword_indices = []
         
-        # Combine results
-        results = set()
+        # Combine results with Reciprocal Rank Fusion; both searches share the
+        # doc_{i} ids, so a chunk found by both is merged and ranked higher
+        results = {}
+        scores = {}
         
         # Add vector search results
-        for doc, metadata in zip(vector_results['documents'][0], vector_results['metadatas'][0]):
-            results.add((
+        for rank, (doc_id, doc, metadata) in enumerate(zip(
+                vector_results['ids'][0], vector_results['documents'][0], vector_results['metadatas'][0])):
+            results.setdefault(doc_id, (
                 doc,
                 metadata['type'],
                 metadata['page']
             ))
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
         
-        # Add keyword search results
-        for idx in top_keyword_indices:
-            results.add((
-                self.documents[idx],
-                'text',  # Default to text type for BM25 results
-                0       # Default page
-            ))
+        # Add keyword search results, fetching from Chroma only the
+        # chunks the vector search didn't already return
+        keyword_ids = [f"doc_{idx}" for idx in top_keyword_indices]
+        missing = [doc_id for doc_id in keyword_ids if doc_id not in results]
+        if missing:
+            fetched = self.collection.get(ids=missing, include=['documents', 'metadatas'])
+            for doc_id, doc, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+                results[doc_id] = (doc, metadata['type'], metadata['page'])
+        for rank, doc_id in enumerate(keyword_ids):
+            if doc_id in results:
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
         
-        return list(results)
+        return [results[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)]
     
     def query_document(self, question: str) -> str:
         # Get relevant chunks using hybrid search
@@ -120,12 +142,12 @@ class LocalRAG:
         return message.content
 
     def _format_context(self, results: List[Tuple[str, str, int]]) -> str:
-        context_parts = []
-        for content, type_, page in results:
+        context_parts = [None] * len(results)
+        for i, (content, type_, page) in enumerate(results):
             if type_ == 'text':
-                context_parts.append(f"Text content: {content}")
+                context_parts[i] = "Text content: " + content
             else:  # image
-                context_parts.append(f"Image on page {page}: {content}")
+                context_parts[i] = f"Image on page {page}: {content}"
         return "\n\n".join(context_parts)
 
 # Usage example
@@ -8,7 +8,10 @@ setup(
         'PyMuPDF',
         'transformers',
         'sentence-transformers',
+        'torch',
         'Pillow',
         'chromadb',
+        'orjson',
+        'xxhash',
     ],
 )
@@ -0,0 +1,73 @@
+import tempfile
+import numpy as np
+import pytest
+from pdf_parser.cache_manager import PDFProcessingCache
+
+@pytest.fixture
+def cache_dir():
+    """Create and clean up a cache directory"""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        yield cache_dir
+
+def embeddings(*values):
+    """One 4-dim embedding per value, filled with that value"""
+    return np.array([[v] * 4 for v in values], dtype=np.float32)
+
+def test_embedding_round_trip(cache_dir):
+    """Test stored embeddings come back for their keys, None for unknown keys"""
+    cache = PDFProcessingCache(cache_dir)
+    assert cache.get_embeddings("model", ["a"]) == [None]
+
+    cache.put_embeddings("model", ["a", "b"], embeddings(0.25, 0.5))
+    a, missing, b = cache.get_embeddings("model", ["a", "x", "b"])
+    assert missing is None
+    assert a.dtype == np.float32
+    np.testing.assert_array_equal(a, embeddings(0.25)[0])
+    np.testing.assert_array_equal(b, embeddings(0.5)[0])
+
+def test_duplicate_keys_keep_first_embedding(cache_dir):
+    """Test a key is stored once, whether repeated in one call or across calls"""
+    cache = PDFProcessingCache(cache_dir)
+    cache.put_embeddings("model", ["a", "a"], embeddings(0.25, 0.5))
+    cache.put_embeddings("model", ["a", "b"], embeddings(0.75, 1.0))
+    a, b = cache.get_embeddings("model", ["a", "b"])
+    np.testing.assert_array_equal(a, embeddings(0.25)[0])
+    np.testing.assert_array_equal(b, embeddings(1.0)[0])
+
+def test_embeddings_survive_reopening(cache_dir):
+    """Test a new cache on the same directory reads what an earlier one wrote"""
+    PDFProcessingCache(cache_dir).put_embeddings("model", ["a"], embeddings(0.25))
+    reopened = PDFProcessingCache(cache_dir)
+    reopened.put_embeddings("model", ["b"], embeddings(0.5))
+    a, b = reopened.get_embeddings("model", ["a", "b"])
+    np.testing.assert_array_equal(a, embeddings(0.25)[0])
+    np.testing.assert_array_equal(b, embeddings(0.5)[0])
+
+def test_caches_sharing_a_directory(cache_dir):
+    """Test interleaved writes from two open caches on one directory stay aligned"""
+    first = PDFProcessingCache(cache_dir)
+    second = PDFProcessingCache(cache_dir)
+    assert first.get_embeddings("model", ["a"]) == [None]
+    first.put_embeddings("model", ["a"], embeddings(0.25))
+    second.put_embeddings("model", ["b"], embeddings(0.5))
+    first.put_embeddings("model", ["c"], embeddings(0.75))
+
+    for cache in (first, second, PDFProcessingCache(cache_dir)):
+        a, b, c = cache.get_embeddings("model", ["a", "b", "c"])
+        np.testing.assert_array_equal(a, embeddings(0.25)[0])
+        np.testing.assert_array_equal(b, embeddings(0.5)[0])
+        np.testing.assert_array_equal(c, embeddings(0.75)[0])
+
+def test_wrong_width_embeddings_are_rejected(cache_dir):
+    """Test rows of another width raise instead of shifting the stored rows"""
+    cache = PDFProcessingCache(cache_dir)
+    cache.put_embeddings("model", ["a"], embeddings(0.25))
+    with pytest.raises(ValueError):
+        cache.put_embeddings("model", ["b"], np.zeros((1, 3), dtype=np.float32))
+    with pytest.raises(ValueError):
+        cache.put_embeddings("model", ["b", "c"], embeddings(0.5))
+    assert cache.get_embeddings("model", ["b"]) == [None]
+    cache.put_embeddings("model", ["b"], embeddings(0.5))
+    a, b = PDFProcessingCache(cache_dir).get_embeddings("model", ["a", "b"])
+    np.testing.assert_array_equal(a, embeddings(0.25)[0])
+    np.testing.assert_array_equal(b, embeddings(0.5)[0])
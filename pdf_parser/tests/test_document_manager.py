@@ -3,7 +3,11 @@ import pytest
 from pathlib import Path
 import shutil
 from pdf_parser.document_manager import DocumentManager
+from pdf_parser.pdf_processor import ProcessedChunk
+import pdf_parser.document_manager as document_manager
+import numpy as np
 import tempfile
+import types
 
 @pytest.fixture
 def test_dirs():
@@ -59,3 +63,115 @@ def test_document_manager_caching(test_dirs, test_pdf):
     def mock_process(*args, **kwargs):
         nonlocal process_called
         process_called = True
+
+
+class StubProcessor:
+    """Stands in for PDFProcessor without loading models; chunks are set per PDF name"""
+    def __init__(self):
+        self.chunks = {}
+        self.text_model = types.SimpleNamespace(encode=lambda text: np.zeros(3, dtype=np.float32))
+
+    def encode_clip_text(self, text):
+        return np.zeros(2, dtype=np.float32)
+
+    def process_pdf(self, pdf_path, data=None):
+        return self.chunks[Path(pdf_path).stem]
+
+    def embed_content(self, text_blocks, images):
+        return ([text_chunk(f"t{i}", float(i)) for i in range(len(text_blocks))] +
+                [image_chunk(f"i{i}", float(i)) for i in range(len(images))])
+
+def text_chunk(chunk_id, distance):
+    """A text chunk whose embedding is distance away from the stub query"""
+    return ProcessedChunk(content=f"text {chunk_id}", embedding=np.array([distance, 0, 0], dtype=np.float32),
+                          metadata={'page': 0, 'bbox': (0.0, 0.0, 1.0, 1.0)}, chunk_id=chunk_id, type='text')
+
+def image_chunk(chunk_id, distance):
+    """An image chunk in the (smaller) CLIP space, distance away from the stub query"""
+    return ProcessedChunk(content=f"image {chunk_id}", embedding=np.array([distance, 0], dtype=np.float32),
+                          metadata={'page': 0}, chunk_id=chunk_id, type='image')
+
+@pytest.fixture
+def stub_processor(monkeypatch):
+    """Make every DocumentManager use one shared StubProcessor"""
+    stub = StubProcessor()
+    monkeypatch.setattr(document_manager, "PDFProcessor", lambda **kwargs: stub)
+    return stub
+
+def write_pdf(directory, name, content=b"%PDF-1.4 stub"):
+    """Write a file for a stub-processed PDF; only its bytes' hash matters"""
+    path = Path(directory) / f"{name}.pdf"
+    path.write_bytes(content)
+    return str(path)
+
+def test_query_interleaves_text_and_image_ranks(test_dirs, stub_processor):
+    """Test image hits are not crowded out by text hits on a smaller distance scale"""
+    cache_dir, chroma_dir = test_dirs
+    stub_processor.chunks["doc"] = [text_chunk("t1", 0.1), text_chunk("t2", 0.2), text_chunk("t3", 0.3),
+                                    image_chunk("i1", 10.0), image_chunk("i2", 20.0)]
+    manager = DocumentManager(collection_name="test_collection", persist_dir=chroma_dir, cache_dir=cache_dir)
+    manager.process_pdf(write_pdf(cache_dir, "doc"))
+    results = manager.query("anything", n_results=3)
+    assert [r['content'] for r in results] == ["text t1", "image i1", "text t2"]
+
+def test_sharded_manager_without_shards_returns_nothing(test_dirs, stub_processor):
+    """Test a sharded manager on a fresh persist_dir answers queries with no results"""
+    cache_dir, chroma_dir = test_dirs
+    manager = DocumentManager(collection_name="test_collection", persist_dir=chroma_dir,
+                              cache_dir=cache_dir, shard_by="pdf")
+    assert manager.query("anything") == []
+
+def test_shard_routing_rediscovery_and_reset(test_dirs, stub_processor):
+    """Test each PDF gets its own shard, shards are found again on startup, and reset clears them all"""
+    cache_dir, chroma_dir = test_dirs
+    stub_processor.chunks["a"] = [text_chunk("x", 0.1), image_chunk("y", 1.0)]
+    stub_processor.chunks["b"] = [text_chunk("z", 0.2)]
+    manager = DocumentManager(collection_name="test_collection", persist_dir=chroma_dir,
+                              cache_dir=cache_dir, shard_by="pdf")
+    manager.process_pdf(write_pdf(cache_dir, "a"))
+    manager.process_pdf(write_pdf(cache_dir, "b"))
+
+    # Routing: each PDF's chunks are in its own database, none in the shared one
+    assert (Path(chroma_dir) / "a" / "chroma.sqlite3").exists()
+    assert (Path(chroma_dir) / "b" / "chroma.sqlite3").exists()
+    _, a_text, a_images = manager._get_shard("a")
+    _, b_text, b_images = manager._get_shard("b")
+    assert a_text.get()['ids'] == ["a_x"] and a_images.get()['ids'] == ["a_y"]
+    assert b_text.get()['ids'] == ["b_z"] and b_images.count() == 0
+    assert manager.text_collection.count() == 0
+
+    # Re-discovery: a new manager finds the shards and queries across them
+    reopened = DocumentManager(collection_name="test_collection", persist_dir=chroma_dir,
+                               cache_dir=cache_dir, shard_by="pdf")
+    assert set(reopened._shards) == {"a", "b"}
+    results = reopened.query("anything", n_results=3)
+    assert [r['content'] for r in results] == ["text x", "image y", "text z"]
+
+    # Reset empties every shard but keeps them queryable
+    reopened.reset_collection()
+    assert set(reopened._shards) == {"a", "b"}
+    for _, text_collection, image_collection in reopened._shards.values():
+        assert text_collection.count() == 0 and image_collection.count() == 0
+    assert reopened.query("anything") == []
+
+def test_restoring_a_pdf_drops_stale_chunks(test_dirs, stub_processor):
+    """Test storing a changed PDF again leaves only its new chunks, skipping duplicate ids"""
+    cache_dir, chroma_dir = test_dirs
+    manager = DocumentManager(collection_name="test_collection", persist_dir=chroma_dir, cache_dir=cache_dir)
+    stub_processor.chunks["doc"] = [text_chunk("a", 0.1), text_chunk("b", 0.2), image_chunk("i", 1.0)]
+    assert manager.process_pdf(write_pdf(cache_dir, "doc")) == 3
+
+    stub_processor.chunks["doc"] = [text_chunk("a", 0.1), text_chunk("c", 0.3), text_chunk("c", 0.3)]
+    assert manager.process_pdf(write_pdf(cache_dir, "doc", b"%PDF-1.4 changed")) == 2
+    assert sorted(manager.text_collection.get()['ids']) == ["doc_a", "doc_c"]
+    assert manager.image_collection.count() == 0
+
+def test_process_pdfs_extracts_in_worker_processes(test_dirs, test_pdf, stub_processor):
+    """Test PDFs extracted in the process pool are embedded and stored, then skipped once cached"""
+    cache_dir, chroma_dir = test_dirs
+    paths = [shutil.copy(test_pdf, Path(cache_dir) / f"{name}.pdf") for name in ("one", "two")]
+    manager = DocumentManager(collection_name="test_collection", persist_dir=chroma_dir, cache_dir=cache_dir)
+    counts = manager.process_pdfs([str(path) for path in paths], max_workers=2)
+    assert counts[0] > 0 and counts[0] == counts[1]
+    assert manager.text_collection.count() + manager.image_collection.count() == sum(counts)
+    assert manager.process_pdfs([str(path) for path in paths], max_workers=2) == [0, 0]
@@ -0,0 +1,76 @@
+import os
+import fitz
+import numpy as np
+import pytest
+from pdf_parser.pdf_processor import extract_pdf_content, _image_key, CHUNK_WORDS, CHUNK_OVERLAP_WORDS
+
+@pytest.fixture
+def goalkeeper_pdf():
+    """Use a real PDF with long text blocks from the fixtures directory"""
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    pdf_path = os.path.join(test_dir, "fixtures", "goalkeeper-2024.pdf")
+    assert os.path.exists(pdf_path), f"Test PDF not found at {pdf_path}"
+    return pdf_path
+
+def paragraph(name, words=30):
+    """A paragraph of distinct words, so windows can be traced back to it"""
+    return " ".join(f"{name}w{i}" for i in range(words))
+
+def make_pdf(pages, toc=None) -> bytes:
+    """Build a PDF with one text block per paragraph on each page"""
+    doc = fitz.open()
+    for paragraphs in pages:
+        page = doc.new_page()
+        y = 40
+        for text in paragraphs:
+            used = page.insert_textbox(fitz.Rect(40, y, page.rect.width - 40, y + 200), text, fontsize=4)
+            y += 210 - used
+    if toc:
+        doc.set_toc(toc)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def test_windows_fit_text_model(goalkeeper_pdf):
+    """Test no window, even one cut from a long block, exceeds CHUNK_WORDS"""
+    text_blocks, _ = extract_pdf_content(goalkeeper_pdf)
+    assert text_blocks
+    assert max(len(text.split()) for text, _ in text_blocks) <= CHUNK_WORDS
+
+def test_oversized_block_is_split_with_overlap():
+    """Test a block longer than a window is cut into overlapping pieces covering every word"""
+    words = paragraph("big", 400).split()
+    text_blocks, _ = extract_pdf_content("big.pdf", make_pdf([[" ".join(words)]]))
+    pieces = [text.split() for text, _ in text_blocks]
+    assert len(pieces) > 1
+    assert all(len(piece) <= CHUNK_WORDS for piece in pieces)
+    for previous, piece in zip(pieces, pieces[1:]):
+        assert previous[-CHUNK_OVERLAP_WORDS:] == piece[:CHUNK_OVERLAP_WORDS]
+    assert pieces[0][0] == words[0] and pieces[-1][-1] == words[-1]
+
+def test_windows_carry_overlap_across_pages():
+    """Test neighbouring windows share trailing blocks and record the page they end on"""
+    pages = [[paragraph(f"p{page}b{i}") for i in range(4)] for page in range(3)]
+    text_blocks, _ = extract_pdf_content("pages.pdf", make_pdf(pages))
+    assert len(text_blocks) > 1
+    for (previous, _), (text, _) in zip(text_blocks, text_blocks[1:]):
+        assert text.split("\n")[0] == previous.split("\n")[-1]
+    assert any(metadata['page_end'] > metadata['page'] for _, metadata in text_blocks)
+    assert text_blocks[-1][1]['page_end'] == 2
+
+def test_windows_stay_within_sections():
+    """Test no window spans two outline sections, and none carries text across one"""
+    pages = [[paragraph(f"intro{i}") for i in range(3)], [paragraph(f"methods{i}") for i in range(3)]]
+    toc = [[1, "Intro", 1], [1, "Methods", 2]]
+    text_blocks, _ = extract_pdf_content("sections.pdf", make_pdf(pages, toc))
+    assert [metadata['section'] for _, metadata in text_blocks] == ["Intro", "Methods"]
+    (intro, intro_meta), (methods, methods_meta) = text_blocks
+    assert intro_meta['page'] == intro_meta['page_end'] == 0
+    assert methods_meta['page'] == methods_meta['page_end'] == 1
+    assert "methods" not in intro and "intro" not in methods
+
+def test_image_key_includes_layout():
+    """Test images with the same bytes but a different shape get different cache keys"""
+    image = np.arange(2 * 6 * 3, dtype=np.uint8).reshape(2, 6, 3)
+    assert _image_key(image) == _image_key(image.copy())
+    assert _image_key(image) != _image_key(image.reshape(4, 3, 3))
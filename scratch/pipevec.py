@@ -1,56 +1,139 @@
 from langchain import PromptTemplate, LLMChain
 from langchain.llms import OpenAI
-import pinecone
+from pinecone import Pinecone
 from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
+from scipy.sparse import csr_matrix
+
+# Reciprocal Rank Fusion damping constant from Cormack et al.
+RRF_K = 60
+
+
+class SparseBM25:
+    """
+    Okapi BM25 with every (term, doc) contribution scored at index time.
+    
+    Documents and queries are int32 token-id arrays against a shared vocab.
+    Weights live in a sparse (vocab_size, n_docs) matrix, so scoring a query
+    is a gather of its term rows and a column sum instead of a Python loop
+    over every document. Scores match rank_bm25.BM25Okapi.
+    """
+    def __init__(self, doc_token_ids, vocab_size, k1=1.5, b=0.75, epsilon=0.25):
+        n_docs = len(doc_token_ids)
+        doc_lens = np.array([len(tokens) for tokens in doc_token_ids], dtype=np.float64)
+        terms = np.concatenate(doc_token_ids).astype(np.int64)
+        docs = np.repeat(np.arange(n_docs), doc_lens.astype(np.int64))
+        # One entry per distinct (term, doc) pair, counted for its term frequency
+        pairs, tfs = np.unique(terms * n_docs + docs, return_counts=True)
+        rows, cols = np.divmod(pairs, n_docs)
+        
+        doc_freqs = np.bincount(rows, minlength=vocab_size)
+        idf = np.log(n_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        # Same floor as BM25Okapi for terms in more than half the documents
+        idf[idf < 0] = epsilon * idf.mean()
+        
+        norm = k1 * (1 - b + b * doc_lens[cols] / doc_lens.mean())
+        weights = idf[rows] * tfs * (k1 + 1) / (tfs + norm)
+        # Row slicing is cheap in CSR, and a query only touches its own terms' rows
+        self.weights = csr_matrix((weights, (rows, cols)), shape=(vocab_size, n_docs))
+    
+    def get_scores(self, query_token_ids):
+        if not len(query_token_ids):
+            return np.zeros(self.weights.shape[1])
+        return np.asarray(self.weights[query_token_ids].sum(axis=0)).ravel()
 
 class SemanticRAG:
     def __init__(self, pinecone_key, openai_key, index_name):
-        pinecone.init(api_key=pinecone_key)
-        self.index = pinecone.Index(index_name)
+        # pinecone-client v3+ API, which index.list() below also needs;
+        # list() pages ids only on serverless indexes
+        self.index = Pinecone(api_key=pinecone_key).Index(index_name)
         self.llm = OpenAI(api_key=openai_key)
         self.text_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Repeated queries skip the model forward pass
+        self._encode_one = lru_cache(maxsize=4096)(self._encode_query)
+        # Pinecone queries run here while BM25 scores in the calling thread
+        self._semantic_pool = ThreadPoolExecutor(max_workers=16)
         
-        # Cache for BM25
+        # Cache for BM25; doc_ids[i] is the vector id of documents[i]
         self.documents = []
+        self.doc_ids = []
         self.bm25 = None
         self.initialize_keyword_search()
     
-    def initialize_keyword_search(self):
-        # Fetch all documents for keyword search
-        fetch_response = self.index.fetch(ids=self.index.describe_index_stats()['total_vector_count'])
-        for vec in fetch_response.vectors.values():
-            if vec.metadata['type'] == 'text':
-                self.documents.append(vec.metadata['content'])
+    def _fetch_text_documents(self, ids):
+        vectors = self.index.fetch(ids=ids).vectors.values()
+        return [(vec.id, vec.metadata['content']) for vec in vectors if vec.metadata['type'] == 'text']
+    
+    def initialize_keyword_search(self, page_size=1000, max_workers=16):
+        # Fetch all documents for keyword search: list ids page by page and
+        # fetch the pages concurrently, one round trip per page
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for documents in executor.map(self._fetch_text_documents, self.index.list(limit=page_size)):
+                for doc_id, content in documents:
+                    self.doc_ids.append(doc_id)
+                    self.documents.append(content)
         
         # Initialize BM25
-        tokenized_docs = [doc.split() for doc in self.documents]
-        self.bm25 = BM25Okapi(tokenized_docs)
+        # Tokenize once into int32 ids; the vocab is shared with query tokenization
+        self.vocab = {}
+        doc_token_ids = [
+            np.fromiter((self.vocab.setdefault(term, len(self.vocab)) for term in doc.split()), dtype=np.int32)
+            for doc in self.documents
+        ]
+        self.bm25 = SparseBM25(doc_token_ids, len(self.vocab))
+    
+    def _query_token_ids(self, query):
+        # Terms outside the corpus vocabulary can't score, so they are dropped
+        return np.fromiter((self.vocab[term] for term in query.split() if term in self.vocab), dtype=np.int32)
+    
+    def _encode_query(self, query):
+        embedding = self.text_model.encode(query, convert_to_numpy=True)
+        embedding.setflags(write=False)  # shared by every cache hit
+        return embedding
     
     def hybrid_search(self, query, k=5):
-        # Semantic search
-        query_embedding = self.text_model.encode(query)
-        semantic_results = self.index.query(
+        return self._hybrid_search(query, self._encode_one(query), k)
+    
+    def hybrid_search_batch(self, queries, k=5, batch_size=64):
+        # One encode call for all queries, then the I/O-bound index lookups overlap
+        embeddings = self.text_model.encode(list(queries), batch_size=batch_size, convert_to_numpy=True)
+        with ThreadPoolExecutor(max_workers=min(16, max(1, len(embeddings)))) as executor:
+            return list(executor.map(lambda args: self._hybrid_search(*args, k), zip(queries, embeddings)))
+    
+    def _hybrid_search(self, query, query_embedding, k):
+        # Semantic search, in flight while the keyword search scores
+        semantic_future = self._semantic_pool.submit(
+            self.index.query,
             vector=query_embedding,
             top_k=k,
             include_metadata=True
         )
         
         # Keyword search
-        tokenized_query = query.split()
-        keyword_scores = self.bm25.get_scores(tokenized_query)
-        top_keyword_indices = np.argsort(keyword_scores)[-k:][::-1]
+        keyword_scores = self.bm25.get_scores(self._query_token_ids(query))
+        # Partition out the top k in O(N), then order only those
+        k_keyword = min(k, len(keyword_scores))
+        top_keyword_indices = np.argpartition(-keyword_scores, k_keyword - 1)[:k_keyword]
+        top_keyword_indices = top_keyword_indices[np.argsort(-keyword_scores[top_keyword_indices])]
+        
+        semantic_results = semantic_future.result()
         
-        # Combine results
-        combined_results = set()
-        for match in semantic_results.matches:
-            combined_results.add((match.metadata['content'], match.metadata['type'], match.metadata['page']))
+        # Combine results with Reciprocal Rank Fusion, keyed by vector id so a
+        # document found by both searches is merged rather than hashed by content
+        results = {}
+        scores = {}
+        for rank, match in enumerate(semantic_results.matches):
+            results.setdefault(match.id, (match.metadata['content'], match.metadata['type'], match.metadata['page']))
+            scores[match.id] = scores.get(match.id, 0.0) + 1.0 / (RRF_K + rank + 1)
             
-        for idx in top_keyword_indices:
-            combined_results.add((self.documents[idx], 'text', None))
+        for rank, idx in enumerate(top_keyword_indices):
+            doc_id = self.doc_ids[idx]
+            results.setdefault(doc_id, (self.documents[idx], 'text', None))
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
         
-        return list(combined_results)
+        return [results[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)]
     
     def query(self, question, k=5):
         results = self.hybrid_search(question, k)
@@ -3,7 +3,6 @@ from flask_cors import CORS
 import requests
 import os
 from dotenv import load_dotenv
-from pprint import pprint
 from functools import wraps
 from claim_extractor import ClaimExtractor
 
@@ -19,7 +18,11 @@ PROMPT = """Here is a narrative about some work experience I had.  Please help m
 
 """
 
-extractor = ClaimExtractor(schema_name='SIMPLE_SKILL')
+# Repeated requests are answered from ClaimExtractor's response cache, which
+# keeps only replies that parsed, so a failed extraction is retried next time
+CLAIM_CACHE_DIR = os.getenv('CLAIM_CACHE_DIR', '.claim_cache')
+
+extractor = ClaimExtractor(schema_name='SIMPLE_SKILL', cache_dir=CLAIM_CACHE_DIR)
 
 def require_api_key(f):
     @wraps(f)
@@ -41,7 +44,7 @@ def process_text():
 
         # Process with LangChain
         result = extractor.extract_claims(text, PROMPT)
-        pprint(result)
+        app.logger.debug("Extracted claims: %s", result)
 
         return jsonify(result)
 
@@ -49,4 +52,4 @@ def process_text():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run()
@@ -0,0 +1,3 @@
+# WSGI entry point, e.g.
+#   gunicorn -w 4 -k gthread --threads 16 -t 120 wsgi:app
+from app import app